@@ -1,14 +1,37 @@
 import psycopg2
 from dotenv import load_dotenv
 import os
-import requests
-from bs4 import BeautifulSoup
+import io
+import csv
+import asyncio
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
+import soupsieve as sv
 import re
+import traceback
 from datetime import datetime
-import time
 
 load_dotenv()
 
+# 單頁下載上限，正常比賽頁只有幾十 KB，超過就截斷
+_MAX_PAGE_BYTES = 512 * 1024
+
+# 比賽日期時間格式，預先編譯避免每頁重新查表
+_DATETIME_RE = re.compile(r'(\d{4}[-/]\d{2}[-/]\d{2})\s+(\d{2}:\d{2})')
+
+# 固定的 CSS selector 預先編譯一次，省去每頁的 selector 編譯與快取查找
+_MATCH_TABLE_SEL = sv.compile(".match_table")
+_GAME_HEADER_SEL = sv.compile(".game_header")
+_HOME_SCORE_SEL = sv.compile(".score_home.big_score")
+_AWAY_SCORE_SEL = sv.compile(".score_away.big_score")
+_BADGE_SEL = sv.compile(".badge")
+
+# 只解析會用到的節點（比賽表格、標頭、比分、狀態徽章），其餘 DOM 直接略過
+_PARSE_FILTER = SoupStrainer(
+    ["table", "div", "span"],
+    attrs={"class": re.compile(r"match_table|game_header|score_(home|away)|big_score|badge")},
+)
+
 
 class TVLUpdater:
     def __init__(self, debug=False):
@@ -33,12 +56,24 @@ class TVLUpdater:
         self.connection = None
         self.cursor = None
 
+        # 待寫入的比賽資料，抓完後一次批次寫入
+        self._pending = []
+
+        # 已完賽的 (match_id, gender)，結果不會再變動，跳過重抓
+        self._done = set()
+
         # 男生: 264–326
         self.male_range = (264, 326)
         # 女生: 228–278
         self.female_range = (228, 278)
-        
+
+        # 同時最多 8 個請求，整體速率仍維持約每 0.5 秒 8 個請求的禮貌上限
+        self.max_concurrency = 8
+        self._sem = None
+
         self.debug = debug
+        # debug 關閉時綁定 no-op，熱路徑上不用每次判斷旗標
+        self._dbg = print if debug else (lambda *a, **k: None)
 
     # -------------------------------------------------------
     # 資料庫
@@ -46,6 +81,15 @@ class TVLUpdater:
     def connect(self):
         try:
             params = self.db_config.copy()
+
+            # TCP keepalive，避免長時間抓取中連線被中途收掉
+            params["keepalives"] = 1
+            params["keepalives_idle"] = 30
+            params["keepalives_interval"] = 10
+            params["keepalives_count"] = 5
+            params["application_name"] = "tvl_scraper"
+            params["sslmode"] = "require"
+
             if "pooler.supabase.com" in params.get("host", ""):
                 print("檢測到 Supabase Pooler，使用安全 timeout 設定…")
                 params["options"] = "-c statement_timeout=60000"
@@ -98,65 +142,91 @@ class TVLUpdater:
         self.connection.commit()
         print("✅ 資料表建立完成")
 
+    def load_finished(self):
+        """撈出已完賽的比賽清單，這些結果固定了，不用再抓"""
+        try:
+            self.cursor.execute(
+                "SELECT match_id, gender FROM tvl_matches WHERE status = 'finished'"
+            )
+            done = set(self.cursor.fetchall())
+            if done:
+                print(f"⏭️  已完賽 {len(done)} 場，略過重抓")
+            return done
+        except Exception as e:
+            print(f"⚠️  讀取已完賽清單失敗: {e}")
+            self.connection.rollback()
+            return set()
+
     # -------------------------------------------------------
     # 抓取單一比賽頁面
     # -------------------------------------------------------
-    def fetch_page(self, match_id, gender):
+    async def fetch_page(self, session, match_id, gender):
         if gender == "male":
             url = f"{self.base_url}/game/{match_id}"
         else:
             url = f"{self.base_url}/wgame/{match_id}"
 
         try:
-            r = requests.get(url, headers=self.headers, timeout=20)
-
-            if r.status_code != 200:
-                if self.debug:
-                    print(f"[{gender}] {match_id} 回傳 {r.status_code}，跳過")
+            async with self._sem:
+                for attempt in range(3):
+                    async with session.get(url) as r:
+                        status = r.status
+                        content = bytearray()
+                        if status == 200:
+                            # 串流讀取並設上限，非 200 的頁面連 body 都不用下載
+                            async for chunk in r.content.iter_chunked(16384):
+                                content.extend(chunk)
+                                if len(content) >= _MAX_PAGE_BYTES:
+                                    break
+                    if status not in (502, 503, 504):
+                        break
+                    # 暫時性的伺服器錯誤，退避後重試
+                    await asyncio.sleep(0.3 * (2 ** attempt))
+                # 在 semaphore 內稍作等待，把整體速率壓在原本的禮貌上限內
+                await asyncio.sleep(0.5 / self.max_concurrency)
+
+            if status != 200:
+                self._dbg(f"[{gender}] {match_id} 回傳 {status}，跳過")
                 return None
 
-            if len(r.content) < 10000:
-                if self.debug:
-                    print(f"[{gender}] {match_id} 頁面太小，跳過")
+            if len(content) < 10000:
+                self._dbg(f"[{gender}] {match_id} 頁面太小，跳過")
                 return None
 
-            soup = BeautifulSoup(r.text, "html.parser")
+            # 用 lxml 解析器（C 實作），直接餵 bytes 讓編碼偵測交給 lxml
+            soup = BeautifulSoup(bytes(content), "lxml", parse_only=_PARSE_FILTER)
             return soup
 
         except Exception as e:
             print(f"[{gender}] {match_id} 抓取失敗: {e}")
             return None
 
+    async def _process(self, session, match_id, gender):
+        """抓取並解析單場比賽，失敗回傳 None"""
+        soup = await self.fetch_page(session, match_id, gender)
+        if not soup:
+            return None
+        return self.parse_match(match_id, gender, soup)
+
     # -------------------------------------------------------
     # 解析球隊（直接從表格抓名稱）
     # -------------------------------------------------------
-    def get_team_names(self, soup):
-        """直接從比賽表格抓取球隊名稱"""
+    def get_team_names(self, rows):
+        """直接從比賽表格的列抓取球隊名稱"""
         try:
-            match_table = soup.select_one(".match_table")
-            if not match_table:
-                return None, None
-            
-            tbody = match_table.find("tbody")
-            if not tbody:
-                return None, None
-            
-            rows = tbody.find_all("tr")
             if len(rows) < 2:
                 return None, None
-            
+
             # 第一列是主隊，第二列是客隊
             home_name = rows[0].find("td").text.strip()
             away_name = rows[1].find("td").text.strip()
             
-            if self.debug:
-                print(f"  📋 球隊: {home_name} vs {away_name}")
-            
+            self._dbg(f"  📋 球隊: {home_name} vs {away_name}")
+
             return home_name, away_name
-            
+
         except Exception as e:
-            if self.debug:
-                print(f"  ⚠️  球隊解析失敗: {e}")
+            self._dbg(f"  ⚠️  球隊解析失敗: {e}")
             return None, None
 
     # -------------------------------------------------------
@@ -165,41 +235,39 @@ class TVLUpdater:
     def parse_datetime(self, soup):
         """從 HTML 中解析日期和時間"""
         try:
-            game_header = soup.select_one(".game_header")
+            game_header = _GAME_HEADER_SEL.select_one(soup)
             if not game_header:
                 return None, None
             
             text = game_header.get_text()
-            datetime_match = re.search(r'(\d{4}[-/]\d{2}[-/]\d{2})\s+(\d{2}:\d{2})', text)
+            datetime_match = _DATETIME_RE.search(text)
             
             if datetime_match:
                 date_str = datetime_match.group(1).replace('/', '-')
                 time_str = datetime_match.group(2)
                 
-                if self.debug:
-                    print(f"  📅 日期: {date_str}, 時間: {time_str}")
-                
+                self._dbg(f"  📅 日期: {date_str}, 時間: {time_str}")
+
                 return date_str, time_str
-            
+
             return None, None
-            
+
         except Exception as e:
-            if self.debug:
-                print(f"  ⚠️  日期解析失敗: {e}")
+            self._dbg(f"  ⚠️  日期解析失敗: {e}")
             return None, None
 
     # -------------------------------------------------------
     # 解析比分和狀態
     # -------------------------------------------------------
-    def parse_score_and_status(self, soup):
+    def parse_score_and_status(self, soup, rows):
         """解析比分和比賽狀態"""
         try:
             # 找大比分
-            home_score_tag = soup.select_one(".score_home.big_score")
-            away_score_tag = soup.select_one(".score_away.big_score")
-            
+            home_score_tag = _HOME_SCORE_SEL.select_one(soup)
+            away_score_tag = _AWAY_SCORE_SEL.select_one(soup)
+
             # 找狀態
-            status_badge = soup.select_one(".badge")
+            status_badge = _BADGE_SEL.select_one(soup)
             status = "scheduled"
             
             if status_badge:
@@ -222,35 +290,29 @@ class TVLUpdater:
             
             # 解析局數比分
             set_scores = []
-            table = soup.select_one(".match_table")
-            
-            if table:
-                rows = table.select("tbody tr")
-                if len(rows) >= 2:
-                    home_row = rows[0]
-                    away_row = rows[1]
-                    
-                    for i in range(1, 6):
-                        home_cell = home_row.select_one(f"#q{i}_home")
-                        away_cell = away_row.select_one(f"#q{i}_away")
-                        
-                        if home_cell and away_cell:
-                            home_set = home_cell.text.strip()
-                            away_set = away_cell.text.strip()
-                            
-                            if home_set and away_set and home_set.isdigit() and away_set.isdigit():
-                                set_scores.append(f"{home_set}-{away_set}")
+
+            if len(rows) >= 2:
+                # 每列的 td 只掃一次，依 id 建表，取代每局兩次 select_one
+                home_tds = {td.get("id"): td.get_text(strip=True)
+                            for td in rows[0].find_all("td") if td.get("id", "").startswith("q")}
+                away_tds = {td.get("id"): td.get_text(strip=True)
+                            for td in rows[1].find_all("td") if td.get("id", "").startswith("q")}
+
+                for i in range(1, 6):
+                    home_set = home_tds.get(f"q{i}_home", "")
+                    away_set = away_tds.get(f"q{i}_away", "")
+
+                    if home_set and away_set and home_set.isdigit() and away_set.isdigit():
+                        set_scores.append(f"{home_set}-{away_set}")
             
             set_scores_str = ", ".join(set_scores) if set_scores else None
             
-            if self.debug:
-                print(f"  🏐 狀態: {status}, 比分: {home_score}-{away_score}")
-            
+            self._dbg(f"  🏐 狀態: {status}, 比分: {home_score}-{away_score}")
+
             return (status, home_score, away_score, set_scores_str)
-            
+
         except Exception as e:
-            if self.debug:
-                print(f"  ⚠️  比分解析失敗: {e}")
+            self._dbg(f"  ⚠️  比分解析失敗: {e}")
             return ("scheduled", None, None, None)
 
     # -------------------------------------------------------
@@ -258,18 +320,22 @@ class TVLUpdater:
     # -------------------------------------------------------
     def parse_match(self, match_id, gender, soup):
         try:
+            # 比賽表格只找一次，球隊與比分解析共用同一組列
+            match_table = _MATCH_TABLE_SEL.select_one(soup)
+            tbody = match_table.find("tbody") if match_table else None
+            rows = tbody.find_all("tr") if tbody else []
+
             # 抓球隊名稱
-            home_name, away_name = self.get_team_names(soup)
+            home_name, away_name = self.get_team_names(rows)
             if not home_name or not away_name:
-                if self.debug:
-                    print(f"[{gender}] {match_id} 找不到球隊")
+                self._dbg(f"[{gender}] {match_id} 找不到球隊")
                 return None
 
             # 抓日期時間
             match_date, match_time = self.parse_datetime(soup)
 
             # 抓比分和狀態
-            status, home_score, away_score, set_scores = self.parse_score_and_status(soup)
+            status, home_score, away_score, set_scores = self.parse_score_and_status(soup, rows)
 
             return {
                 "match_id": match_id,
@@ -288,7 +354,6 @@ class TVLUpdater:
         except Exception as e:
             print(f"[{gender}] {match_id} 解析失敗: {e}")
             if self.debug:
-                import traceback
                 traceback.print_exc()
             return None
 
@@ -296,26 +361,8 @@ class TVLUpdater:
     # 寫入資料庫
     # -------------------------------------------------------
     def insert_match(self, data):
-        sql = """
-        INSERT INTO tvl_matches
-        (match_id, gender, match_date, match_time,
-         home_team_name, away_team_name,
-         status, home_score, away_score, set_scores, url)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        ON CONFLICT (match_id, gender) DO UPDATE SET
-            match_date = EXCLUDED.match_date,
-            match_time = EXCLUDED.match_time,
-            home_team_name = EXCLUDED.home_team_name,
-            away_team_name = EXCLUDED.away_team_name,
-            status = EXCLUDED.status,
-            home_score = EXCLUDED.home_score,
-            away_score = EXCLUDED.away_score,
-            set_scores = EXCLUDED.set_scores,
-            scraped_at = NOW();
-        """
-
-        self.cursor.execute(
-            sql,
+        """把一場比賽加入待寫入批次"""
+        self._pending.append(
             (
                 data["match_id"],
                 data["gender"],
@@ -328,68 +375,139 @@ class TVLUpdater:
                 data["away_score"],
                 data["set_scores"],
                 data["url"],
-            ),
+            )
         )
-        self.connection.commit()
+
+    def flush_matches(self):
+        """把累積的比賽用 COPY 進暫存表後一次 upsert 進資料庫"""
+        if not self._pending:
+            return
+
+        # 先把整批 CSV 化，COPY 進暫存表，再一條 INSERT...SELECT upsert 回正式表
+        buf = io.StringIO()
+        csv.writer(buf).writerows(self._pending)
+        buf.seek(0)
+
+        try:
+            self.cursor.execute("""
+                CREATE TEMP TABLE tmp_tvl_matches (
+                    match_id INTEGER,
+                    gender TEXT,
+                    match_date DATE,
+                    match_time TEXT,
+                    home_team_name TEXT,
+                    away_team_name TEXT,
+                    status TEXT,
+                    home_score INTEGER,
+                    away_score INTEGER,
+                    set_scores TEXT,
+                    url TEXT
+                ) ON COMMIT DROP;
+            """)
+
+            self.cursor.copy_expert(
+                """
+                COPY tmp_tvl_matches
+                (match_id, gender, match_date, match_time,
+                 home_team_name, away_team_name,
+                 status, home_score, away_score, set_scores, url)
+                FROM STDIN WITH (FORMAT csv)
+                """,
+                buf,
+            )
+
+            self.cursor.execute("""
+                INSERT INTO tvl_matches
+                (match_id, gender, match_date, match_time,
+                 home_team_name, away_team_name,
+                 status, home_score, away_score, set_scores, url)
+                SELECT match_id, gender, match_date, match_time,
+                       home_team_name, away_team_name,
+                       status, home_score, away_score, set_scores, url
+                FROM tmp_tvl_matches
+                ON CONFLICT (match_id, gender) DO UPDATE SET
+                    match_date = EXCLUDED.match_date,
+                    match_time = EXCLUDED.match_time,
+                    home_team_name = EXCLUDED.home_team_name,
+                    away_team_name = EXCLUDED.away_team_name,
+                    status = EXCLUDED.status,
+                    home_score = EXCLUDED.home_score,
+                    away_score = EXCLUDED.away_score,
+                    set_scores = EXCLUDED.set_scores,
+                    scraped_at = NOW();
+            """)
+
+            self.connection.commit()
+            print(f"💾 批次寫入 {len(self._pending)} 場比賽")
+        except Exception as e:
+            print(f"❌ 批次寫入失敗: {e}")
+            self.connection.rollback()
+        finally:
+            self._pending = []
 
     # -------------------------------------------------------
     # 主流程
     # -------------------------------------------------------
+    async def _scrape(self):
+        """併發抓取兩個組別的所有比賽並寫入資料庫"""
+        total_success = 0
+        total_failed = 0
+        total_skipped = 0
+
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=20)
+        # 固定連線池大小並快取 DNS，讓 TCP/TLS 連線在整輪抓取中重複使用
+        connector = aiohttp.TCPConnector(limit=16, ttl_dns_cache=300)
+
+        async with aiohttp.ClientSession(
+            headers=self.headers, timeout=timeout, connector=connector
+        ) as session:
+            phases = [
+                ("female", "女", self.female_range),
+                ("male", "男", self.male_range),
+            ]
+
+            for gender, label, (start, end) in phases:
+                print("\n" + "="*50)
+                print(f"🏐 開始抓取{label}子組比賽")
+                print("="*50)
+
+                # 已完賽的比賽直接略過，不重抓也不重解析
+                match_ids = [mid for mid in range(start, end + 1)
+                             if (mid, gender) not in self._done]
+                total_skipped += (end - start + 1) - len(match_ids)
+
+                results = await asyncio.gather(
+                    *[self._process(session, match_id, gender)
+                      for match_id in match_ids]
+                )
+
+                for data in results:
+                    if data:
+                        self.insert_match(data)
+                        status_emoji = {"scheduled": "⏰", "live": "🔴", "finished": "✅"}.get(data["status"], "❓")
+                        print(f"{status_emoji} {label} {data['match_id']}: {data['home_name']} vs {data['away_name']}")
+                        total_success += 1
+                    else:
+                        total_failed += 1
+
+                # 每個組別結束就批次寫入並 commit 一次，失敗只影響該組別
+                self.flush_matches()
+
+        print("\n" + "="*50)
+        print(f"✅ 抓取完成！成功: {total_success}, 失敗: {total_failed}, 略過: {total_skipped}")
+        print("="*50)
+
     def run(self):
         if not self.connect():
             return
 
         self.create_tables()
 
-        total_success = 0
-        total_failed = 0
-
-        # 女子組
-        print("\n" + "="*50)
-        print("🏐 開始抓取女子組比賽")
-        print("="*50)
-        
-        for match_id in range(self.female_range[0], self.female_range[1] + 1):
-            soup = self.fetch_page(match_id, "female")
-            if soup:
-                data = self.parse_match(match_id, "female", soup)
-                if data:
-                    self.insert_match(data)
-                    status_emoji = {"scheduled": "⏰", "live": "🔴", "finished": "✅"}.get(data["status"], "❓")
-                    print(f"{status_emoji} 女 {match_id}: {data['home_name']} vs {data['away_name']}")
-                    total_success += 1
-                else:
-                    total_failed += 1
-            else:
-                total_failed += 1
-            
-            time.sleep(0.5)
+        self._done = self.load_finished()
 
-        # 男子組
-        print("\n" + "="*50)
-        print("🏐 開始抓取男子組比賽")
-        print("="*50)
-        
-        for match_id in range(self.male_range[0], self.male_range[1] + 1):
-            soup = self.fetch_page(match_id, "male")
-            if soup:
-                data = self.parse_match(match_id, "male", soup)
-                if data:
-                    self.insert_match(data)
-                    status_emoji = {"scheduled": "⏰", "live": "🔴", "finished": "✅"}.get(data["status"], "❓")
-                    print(f"{status_emoji} 男 {match_id}: {data['home_name']} vs {data['away_name']}")
-                    total_success += 1
-                else:
-                    total_failed += 1
-            else:
-                total_failed += 1
-            
-            time.sleep(0.5)
+        asyncio.run(self._scrape())
 
-        print("\n" + "="*50)
-        print(f"✅ 抓取完成！成功: {total_success}, 失敗: {total_failed}")
-        print("="*50)
-        
         self.close()
 
 
@@ -2,14 +2,21 @@ import psycopg2
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 import os
-import requests
+import asyncio
+import aiohttp
 import json
-import re
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 # 載入環境變數
 load_dotenv()
 
+# 台北時區與星期對照，模組層級常數避免每場比賽重新建立
+TAIPEI_TZ = timezone(timedelta(hours=8))
+_WEEKDAYS = ('一', '二', '三', '四', '五', '六', '日')
+
+# __NEXT_DATA__ JSON 區塊的開頭標記，用 str.find 定位比 regex 掃整頁快得多
+_NEXTDATA_MARK = '<script id="__NEXT_DATA__" type="application/json">'
+
 class TPVLLocalUpdater:
     def __init__(self):
         # 資料庫連線參數
@@ -34,7 +41,15 @@ class TPVLLocalUpdater:
         try:
             # 為 Pooler 連線添加特殊參數
             connection_params = self.db_config.copy()
-            
+
+            # TCP keepalive,避免長時間執行中連線被中途收掉
+            connection_params['keepalives'] = 1
+            connection_params['keepalives_idle'] = 30
+            connection_params['keepalives_interval'] = 10
+            connection_params['keepalives_count'] = 5
+            connection_params['application_name'] = 'tpvl_scraper'
+            connection_params['sslmode'] = 'require'
+
             # 如果使用 Pooler,添加這些參數
             if 'pooler.supabase.com' in connection_params.get('host', ''):
                 print("  檢測到 Pooler 連線,使用最佳化設定...")
@@ -118,40 +133,54 @@ class TPVLLocalUpdater:
     
     def extract_json_data(self, html):
         """從 HTML 提取 JSON"""
-        pattern = r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>'
-        match = re.search(pattern, html, re.DOTALL)
-        if match:
-            return json.loads(match.group(1))
-        return None
+        start = html.find(_NEXTDATA_MARK)
+        if start < 0:
+            return None
+        start += len(_NEXTDATA_MARK)
+        end = html.find('</script>', start)
+        if end < 0:
+            return None
+        return json.loads(html[start:end])
     
-    def fetch_schedule(self, result_page=1, future_page=1):
+    async def fetch_schedule(self, session, result_page=1, future_page=1):
         """抓取賽程"""
         url = f"{self.base_url}?resultPage={result_page}&futurePage={future_page}"
-        
+
         try:
             print(f"  抓取: 第{result_page}頁賽果 / 第{future_page}頁未來...")
-            response = requests.get(url, headers=self.headers, timeout=15)
-            response.raise_for_status()
-            
-            data = self.extract_json_data(response.text)
+            async with session.get(url) as response:
+                response.raise_for_status()
+                html = await response.text()
+
+            data = self.extract_json_data(html)
             if not data:
-                return None, None
-            
+                return None
+
             page_props = data['props']['pageProps']
-            
+
             result_matches = page_props.get('resultMatchData', {}).get('data', [])
             future_matches = page_props.get('incomingMatch', {}).get('data', [])
             squads = page_props.get('squads', [])
-            
+
             return {
                 'results': result_matches,
                 'futures': future_matches,
                 'squads': squads
             }
-            
+
         except Exception as e:
             print(f"  ❌ 抓取失敗: {e}")
             return None
+
+    async def _fetch_all_pages(self):
+        """併發抓取所有賽程頁面（頁數少，不需要限流）"""
+        combos = [(1, 1), (2, 1), (3, 1), (4, 1), (1, 2)]
+        timeout = aiohttp.ClientTimeout(total=15)
+
+        async with aiohttp.ClientSession(headers=self.headers, timeout=timeout) as session:
+            return await asyncio.gather(
+                *[self.fetch_schedule(session, rp, fp) for rp, fp in combos]
+            )
     
     def upsert_teams(self, teams_data):
         """更新球隊資料 (Upsert)"""
@@ -159,7 +188,7 @@ class TPVLLocalUpdater:
         
         # 使用 ON CONFLICT ... DO UPDATE 實現 upsert
         sql = """
-        INSERT INTO tpvl_teams (id, name, name_en, logo_url, updated_at)
+        INSERT INTO tpvl_teams (id, name, name_en, logo_url)
         VALUES %s
         ON CONFLICT (id) DO UPDATE SET
             name = EXCLUDED.name,
@@ -168,19 +197,19 @@ class TPVLLocalUpdater:
             updated_at = NOW()
         """
         
+        # updated_at 交給資料表 DEFAULT / ON CONFLICT 的 NOW() 處理
         values = [
             (
                 team['id'],
                 team['name'],
                 team['altName'],
-                team['logoUrl'],
-                datetime.now()
+                team['logoUrl']
             )
             for team in teams_data
         ]
         
         try:
-            execute_values(self.cursor, sql, values)
+            execute_values(self.cursor, sql, values, page_size=1000)
             self.connection.commit()
             print(f"  ✅ 成功更新 {len(values)} 支球隊")
             
@@ -196,8 +225,7 @@ class TPVLLocalUpdater:
         """解析比賽資料"""
         # UTC -> 台北時間
         matched_at = match_data['matchedAt']
-        dt = datetime.fromisoformat(matched_at.replace('Z', '+00:00'))
-        taipei_dt = dt + timedelta(hours=8)
+        taipei_dt = datetime.fromisoformat(matched_at.replace('Z', '+00:00')).astimezone(TAIPEI_TZ)
         
         # 處理比分
         status = 'upcoming'
@@ -217,24 +245,23 @@ class TPVLLocalUpdater:
             match_data['code'],
             taipei_dt.date(),
             taipei_dt.time(),
-            ['一', '二', '三', '四', '五', '六', '日'][taipei_dt.weekday()],
+            _WEEKDAYS[taipei_dt.weekday()],
             match_data['homeSquadId'],
             match_data['awaySquadId'],
             match_data['venue'],
             status,
             home_score,
-            away_score,
-            datetime.now()
+            away_score
         )
     
-    def upsert_matches(self, matches_data):
-        """更新比賽資料"""
-        print(f"\n⚡ 更新 {len(matches_data)} 場比賽...")
+    def upsert_matches(self, values):
+        """更新比賽資料（接收 parse_match 解析後的 tuple 列表）"""
+        print(f"\n⚡ 更新 {len(values)} 場比賽...")
         
         sql = """
-        INSERT INTO tpvl_matches 
-        (id, code, match_date, match_time, weekday, home_team_id, away_team_id, 
-         venue, status, home_score, away_score, updated_at)
+        INSERT INTO tpvl_matches
+        (id, code, match_date, match_time, weekday, home_team_id, away_team_id,
+         venue, status, home_score, away_score)
         VALUES %s
         ON CONFLICT (id) DO UPDATE SET
             code = EXCLUDED.code,
@@ -250,22 +277,18 @@ class TPVLLocalUpdater:
             updated_at = NOW()
         """
         
-        values = [self.parse_match(m) for m in matches_data]
-        
         try:
-            execute_values(self.cursor, sql, values)
+            execute_values(self.cursor, sql, values, page_size=1000)
             self.connection.commit()
             print(f"  ✅ 成功更新 {len(values)} 場比賽")
-            
-            # 顯示最近5場
+
+            # 顯示最近5場（直接用已解析的 tuple，不再重跑 parse_match）
             print("\n  最近的比賽:")
-            for match in matches_data[:5]:
-                parsed = self.parse_match(match)
+            for parsed in values[:5]:
                 date, time, weekday = parsed[2], parsed[3], parsed[4]
-                home_id, away_id = parsed[5], parsed[6]
                 venue = parsed[7]
                 print(f"    場次{parsed[1]}: {date}({weekday}) {time} @ {venue}")
-            
+
         except Exception as e:
             print(f"  ❌ 更新失敗: {e}")
             self.connection.rollback()
@@ -286,43 +309,45 @@ class TPVLLocalUpdater:
             self.close()
             return
         
-        # 3. 抓取資料
+        # 3. 抓取資料（5 頁互相獨立，直接併發）
         print("\n🌐 開始抓取賽程資料...")
         all_matches = []
         all_squads = []
-        
+
+        pages = asyncio.run(self._fetch_all_pages())
+
         # 第一頁 (包含球隊資料)
-        data = self.fetch_schedule(result_page=1, future_page=1)
+        data = pages[0]
         if data:
             all_squads = data['squads']
             all_matches.extend(data['results'])
             all_matches.extend(data['futures'])
-        
+
         # 過去賽果 (2-4頁)
-        for page in range(2, 5):
-            data = self.fetch_schedule(result_page=page, future_page=1)
+        for data in pages[1:4]:
             if data and data['results']:
                 all_matches.extend(data['results'])
-        
+
         # 未來賽程 (第2頁)
-        data = self.fetch_schedule(result_page=1, future_page=2)
+        data = pages[4]
         if data and data['futures']:
             all_matches.extend(data['futures'])
         
-        # 去重
-        unique_matches = {m['id']: m for m in all_matches}.values()
-        
+        # 去重後只解析一次，後續都用解析好的 tuple
+        unique_matches = list({m['id']: m for m in all_matches}.values())
+        parsed_rows = [self.parse_match(m) for m in unique_matches]
+
         print(f"\n📊 抓取結果:")
         print(f"  - 球隊: {len(all_squads)} 支")
-        print(f"  - 比賽: {len(unique_matches)} 場")
-        
+        print(f"  - 比賽: {len(parsed_rows)} 場")
+
         # 4. 更新球隊
         if all_squads:
             self.upsert_teams(all_squads)
-        
+
         # 5. 更新比賽
-        if unique_matches:
-            self.upsert_matches(list(unique_matches))
+        if parsed_rows:
+            self.upsert_matches(parsed_rows)
         
         # 6. 驗證資料
         self.verify_data()